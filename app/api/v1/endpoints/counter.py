@@ -21,7 +21,7 @@ async def record_visit(
 ):
     """Record a visit for a website"""
     try:
-        result = await counter_service.increament_visit(page_id)
+        result = await counter_service.increment_visit(page_id)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
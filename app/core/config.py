@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from pydantic import model_validator
+from pydantic import Field, model_validator
 import os
 
 class Settings(BaseSettings):
@@ -8,6 +8,14 @@ class Settings(BaseSettings):
     
     REDIS_PASSWORD: str = ""
     REDIS_DB: int = 0
+    REDIS_MAX_CONNECTIONS: int = 64
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    
+    # Number of Redis hashes per node that page counters are spread across.
+    # Fixed for the life of the data: changing it moves pages to other hashes
+    # and existing counts read as 0.
+    VISIT_SHARDS: int = Field(16, gt=0)
     
     # Consistent Hashing Configuration
     VIRTUAL_NODES: int = 100
@@ -1,9 +1,18 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .core.config import settings
 from .api.v1.api import api_router
+from .api.v1.endpoints.counter import get_visit_counter_service
 
-app = FastAPI(title="Visit Counter Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the Redis clients once at startup and release them on shutdown
+    counter_service = get_visit_counter_service()
+    yield
+    await counter_service.close()
+
+app = FastAPI(title="Visit Counter Service", lifespan=lifespan)
 
 # CORS middleware configuration
 app.add_middleware(
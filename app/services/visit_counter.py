@@ -1,140 +1,330 @@
-from typing import Dict, Any
-import redis
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict, defaultdict
+import asyncio
+import redis.asyncio as aioredis
 import time
+import weakref
 import logging
-import hashlib
-from bisect import bisect
+import xxhash
+import uuid
+from ..core.config import settings
+from array import array
+from bisect import bisect_left
+
+# Applies hits at most once each, so a hit whose outcome is unknown (e.g. the
+# reply timed out) can be retried without double counting.
+# KEYS: counter hash, hit-marker hash
+# ARGV: page field, marker TTL, n, n hit ids to apply, then confirmed hit ids
+# whose markers are no longer needed
+_INCR_SCRIPT = """
+local n = tonumber(ARGV[3])
+local added = 0
+for i = 4, 3 + n do
+    added = added + redis.call('HSETNX', KEYS[2], ARGV[i], 1)
+end
+if #ARGV > 3 + n then
+    redis.call('HDEL', KEYS[2], unpack(ARGV, 4 + n))
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if added > 0 then
+    return redis.call('HINCRBY', KEYS[1], ARGV[1], added)
+end
+return tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+"""
+_HIT_MARKER_TTL = 86400  # seconds an unconfirmed hit id is remembered
 
 class ConsistentHash:
-    def _init_(self, nodes: list, virtual_nodes: int = 100):
+    # Cap on virtual keys across the ring, applied at construction
+    MAX_RING_SIZE = 10000
+
+    def __init__(self, nodes: list, virtual_nodes: int = 100):
         """Initialize the consistent hash ring"""
+        if nodes:
+            virtual_nodes = max(1, min(virtual_nodes, self.MAX_RING_SIZE // len(nodes)))
         self.virtual_nodes = virtual_nodes
-        self.hash_ring = {}
-        self.sorted_keys = []
+        # Ring stored as parallel arrays: sorted hashes and the node owning each
+        self._hashes = array('Q')
+        self._nodes: List[str] = []
         
-        for node in nodes:
-            self.add_node(node)
+        # Hash every virtual node up front and sort the ring once
+        self._rebuild([pair for node in nodes for pair in self._virtual_hashes(node)])
     
     def _get_hash(self, key: str) -> int:
         """Generate hash for a key"""
-        return int(hashlib.md5(key.encode()).hexdigest(), 16)
+        return xxhash.xxh64_intdigest(key)
+    
+    def _virtual_hashes(self, node: str) -> list:
+        """Return (hash, node) pairs for all virtual nodes of a node"""
+        return [(self._get_hash(f"{node}_{i}"), node) for i in range(self.virtual_nodes)]
+    
+    def _rebuild(self, pairs: list) -> None:
+        """Rebuild the ring arrays from (hash, node) pairs"""
+        pairs.sort()
+        self._hashes = array('Q', [hash_value for hash_value, _ in pairs])
+        self._nodes = [node for _, node in pairs]
     
     def add_node(self, node: str) -> None:
         """Add a node to the hash ring"""
-        for i in range(self.virtual_nodes):
-            virtual_node = f"{node}_{i}"
-            hash_value = self._get_hash(virtual_node)
-            self.hash_ring[hash_value] = node
-            self.sorted_keys.append(hash_value)
-        self.sorted_keys.sort()
+        if node in self._nodes:
+            return
+        for hash_value, _ in self._virtual_hashes(node):
+            index = bisect_left(self._hashes, hash_value)
+            self._hashes.insert(index, hash_value)
+            self._nodes.insert(index, node)
     
     def remove_node(self, node: str) -> None:
         """Remove a node from the hash ring"""
-        for i in range(self.virtual_nodes):
-            virtual_node = f"{node}_{i}"
-            hash_value = self._get_hash(virtual_node)
-            if hash_value in self.hash_ring:
-                del self.hash_ring[hash_value]
-                self.sorted_keys.remove(hash_value)
+        for hash_value, _ in self._virtual_hashes(node):
+            index = bisect_left(self._hashes, hash_value)
+            if (index < len(self._hashes) and self._hashes[index] == hash_value
+                    and self._nodes[index] == node):
+                del self._hashes[index]
+                del self._nodes[index]
     
     def get_node(self, key: str) -> str:
         """Get the node responsible for the given key"""
-        if not self.hash_ring:
+        if not self._hashes:
             raise Exception("Hash ring is empty")
         
-        key_hash = self._get_hash(key)
-        index = bisect(self.sorted_keys, key_hash)
-        
-        if index >= len(self.sorted_keys):
+        index = bisect_left(self._hashes, self._get_hash(key))
+        if index == len(self._hashes):
             index = 0
             
-        return self.hash_ring[self.sorted_keys[index]]
-
+        return self._nodes[index]
 
 class VisitCounterService:
     _instance = None
     _initialized = False
 
-    def _new_(cls):
+    def __new__(cls):
         if cls._instance is None:
-            cls.instance = super().new_(cls)
+            cls._instance = super().__new__(cls)
         return cls._instance
 
-    def _init_(self):
+    def __init__(self):
         if self._initialized:
             return
 
         """Initialize the visit counter service"""
        
+        # One explicit, health-checked pool per node; when all connections are
+        # busy, callers wait up to REDIS_POOL_TIMEOUT seconds for a free one
+        self._pools = {
+            node: aioredis.BlockingConnectionPool(
+                host=host,
+                port=port,
+                decode_responses=False,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_POOL_TIMEOUT,
+                health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+                socket_keepalive=True
+            )
+            for node, host, port in [('redis_7070', 'redis1', 7070), ('redis_7071', 'redis2', 7071)]
+        }
         self.redis_nodes = {
-            'redis_7070': redis.Redis(host='redis1', port=7070, decode_responses=True),
-            'redis_7071': redis.Redis(host='redis2', port=7071, decode_responses=True)
+            node: aioredis.Redis(connection_pool=pool) for node, pool in self._pools.items()
         }
         
       
         self.consistent_hash = ConsistentHash(['redis_7070', 'redis_7071'])
         
      
-        self._cache: Dict[str, Dict[str, Any]] = {}
+        # LRU-ordered so the least recently used page is evicted first
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self.cache_ttl = 5  # 5 seconds
+        self.max_cache_entries = 100_000
+        # Counters live as fields of sharded hashes ("visits:<shard>"). A hash keeps
+        # Redis' compact listpack encoding only up to hash-max-listpack-entries
+        # fields (128 by default), i.e. about VISIT_SHARDS * 128 pages per node.
+        # VISIT_SHARDS must be chosen before data exists, since changing it moves
+        # pages to other hashes; for larger working sets raise the Redis setting.
+        self.visit_shards = settings.VISIT_SHARDS
+        self._key_cache: Dict[str, Tuple[bytes, bytes]] = {}
+        # Per-page miss locks; entries vanish once no coroutine holds the lock
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
         
       
-        self._write_buffer: Dict[str, Dict[str, int]] = {
-            'redis_7070': {},
-            'redis_7071': {}
+        # Hits Redis has not confirmed, as page -> hit ids. Some may already have
+        # been applied (outcome unknown), so reads can over-report by those hits
+        # until the retry confirms them.
+        self._write_buffer: Dict[str, "defaultdict[str, List[bytes]]"] = {
+            node: defaultdict(list) for node in self.redis_nodes
+        }
+        self._flushing: Dict[str, Dict[str, List[bytes]]] = {
+            node: {} for node in self.redis_nodes
+        }
+        # Buffered hits are flushed after max_flush_delay or as soon as
+        # max_buffer_entries pages are waiting, whichever comes first
+        self.max_flush_delay = 0.001  # 1 millisecond
+        self.max_buffer_entries = 512
+        self._flush_event = asyncio.Event()
+        self._buffer_full = asyncio.Event()
+        self._flush_task = None
+        # Failed flushes are retried with exponential backoff up to max_retry_delay.
+        # A node that answers a request while it has a backlog is added to
+        # _recovered_nodes and retried immediately.
+        self.max_retry_delay = 5.0  # 5 seconds
+        self._redis_recovered = asyncio.Event()
+        self._recovered_nodes: set = set()
+        # Every hit carries an id, recorded in a per-process marker hash on its
+        # node. Confirmed ids are deleted on a later call, up to max_forget_batch
+        # at a time.
+        self._incr_scripts = {
+            node: redis_client.register_script(_INCR_SCRIPT)
+            for node, redis_client in self.redis_nodes.items()
         }
-        self.flush_interval = 30  # 30 seconds
-        self.last_flush_time = time.time()
+        self._marker_key = b"visits:hits:" + uuid.uuid4().hex.encode()
+        self._hit_seq = 0
+        self._confirmed_hits: Dict[str, List[bytes]] = {node: [] for node in self.redis_nodes}
+        self.max_forget_batch = 512
+        
+        # Reads that miss the cache within one event-loop tick share one round-trip
+        self._pending_reads: Dict[str, Dict[str, asyncio.Future]] = {
+            node: {} for node in self.redis_nodes
+        }
+        self.max_read_batch = 512
+        # Strong references so drain tasks aren't garbage-collected mid-run
+        self._drain_tasks: set = set()
         
         self._initialized = True
 
+    async def close(self) -> None:
+        """Flush pending hits and close all Redis connections"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush_buffer()
+        for redis_client in self.redis_nodes.values():
+            await redis_client.aclose()
+        for pool in self._pools.values():
+            await pool.disconnect()
+
     def _get_redis_client(self, page_id: str) -> tuple:
         """Get the appropriate Redis client and node name for a page_id"""
         node = self.consistent_hash.get_node(page_id)
         return self.redis_nodes[node], node
 
+    def _key(self, page_id: str) -> Tuple[bytes, bytes]:
+        """Return the encoded (hash key, field) for a page, building it once per page"""
+        key = self._key_cache.get(page_id)
+        if key is None:
+            if len(self._key_cache) >= self.max_cache_entries:
+                self._key_cache.clear()
+            field = page_id.encode()
+            shard = xxhash.xxh64_intdigest(field) % self.visit_shards
+            key = (b"visits:%d" % shard, field)
+            self._key_cache[page_id] = key
+        return key
+
+    def _set_cache(self, page_id: str, entry: Dict[str, Any]) -> None:
+        """Store a cache entry, evicting the least recently used page when full"""
+        self._cache[page_id] = entry
+        self._cache.move_to_end(page_id)
+        if len(self._cache) > self.max_cache_entries:
+            self._cache.popitem(last=False)
+
+    def _read_count(self, page_id: str, node: str) -> asyncio.Future:
+        """Queue a page for the next batched read on its node"""
+        pending = self._pending_reads[node]
+        future = pending.get(page_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            pending[page_id] = future
+            if len(pending) == 1:
+                self._start_drain(node)
+            elif len(pending) >= self.max_read_batch:
+                # Batch is full: drain it now and start collecting a new one
+                self._pending_reads[node] = {}
+                self._start_drain(node, pending)
+        return future
+
+    def _start_drain(self, node: str, batch: Optional[Dict[str, asyncio.Future]] = None) -> None:
+        """Run _drain_reads in a task that is kept alive until it finishes"""
+        task = asyncio.create_task(self._drain_reads(node, batch))
+        self._drain_tasks.add(task)
+        task.add_done_callback(self._drain_tasks.discard)
+
+    async def _drain_reads(self, node: str, batch: Optional[Dict[str, asyncio.Future]] = None) -> None:
+        """Resolve queued reads for a node with one pipelined HMGET per hash"""
+        if batch is None:
+            # Let every coroutine scheduled in this tick join the batch
+            await asyncio.sleep(0)
+            batch = self._pending_reads[node]
+            self._pending_reads[node] = {}
+        if not batch:
+            return
+        
+        by_hash: Dict[bytes, List[str]] = {}
+        for page_id in batch:
+            by_hash.setdefault(self._key(page_id)[0], []).append(page_id)
+        
+        try:
+            pipeline = self.redis_nodes[node].pipeline(transaction=False)
+            for hash_key, page_ids in by_hash.items():
+                pipeline.hmget(hash_key, [self._key(page_id)[1] for page_id in page_ids])
+            replies = await pipeline.execute()
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for page_ids, values in zip(by_hash.values(), replies):
+            for page_id, value in zip(page_ids, values):
+                future = batch[page_id]
+                if not future.done():
+                    future.set_result(value)
+
     async def increment_visit(self, page_id: str) -> Dict[str, Any]:
         """Increment visit count for a page"""
         try:
-           
-            current_time = time.time()
-            if current_time - self.last_flush_time >= self.flush_interval:
-                await self._flush_buffer()
-                self.last_flush_time = current_time
-            
-            
             redis_client, node = self._get_redis_client(page_id)
+            hash_key, field = self._key(page_id)
             
-           
-            if page_id not in self._write_buffer[node]:
-                self._write_buffer[node][page_id] = 0
-            self._write_buffer[node][page_id] += 1
+            hit_id = self._next_hit_id()
+            forget = self._take_confirmed(node)
             
-           
+            # The script returns the post-increment count, so one round-trip is enough
             try:
-                redis_count = int(redis_client.get(f"page:{page_id}") or 0)
+                new_count = await self._incr_scripts[node](
+                    keys=[hash_key, self._marker_key],
+                    args=[field, _HIT_MARKER_TTL, 1, hit_id, *forget],
+                    client=redis_client
+                )
+                self._confirmed_hits[node].append(hit_id)
+                # Count buffered hits too, matching what get_visit_count reports
+                new_count += self._buffered_count(node, page_id)
+                served_via = node
+                if self._has_backlog(node):
+                    # This node is reachable again: let the flush loop retry it right away
+                    self._ensure_flush_loop()
+                    self._recovered_nodes.add(node)
+                    self._redis_recovered.set()
             except Exception as e:
-                logging.error(f"Redis error: {str(e)}")
-                redis_count = 0
-            
-           
-            buffer_count = self._write_buffer[node].get(page_id, 0)
-            total_count = redis_count + buffer_count
+                logging.error("Redis error: %s", e)
+                # Degraded mode: buffer the hit and flush it once Redis is back.
+                # Its id makes the retry safe even if Redis already applied it.
+                self._write_buffer[node][page_id].append(hit_id)
+                self._confirmed_hits[node].extend(forget)
+                self._schedule_flush()
+                cache_entry = self._cache.get(page_id)
+                new_count = (cache_entry["count"] if cache_entry else 0) + 1
+                served_via = "in_memory"
             
             # Update cache
-            self._cache[page_id] = {
-                "count": total_count,
-                "timestamp": time.time(),
+            self._set_cache(page_id, {
+                "count": new_count,
+                "expires_at": time.monotonic() + self.cache_ttl,
                 "node": node
-            }
+            })
             
             return {
-                "visits": total_count,
-                "served_via": node
+                "visits": new_count,
+                "served_via": served_via
             }
             
         except Exception as e:
-            logging.error(f"Error in increment_visit: {str(e)}")
+            logging.error("Error in increment_visit: %s", e)
             # Fallback to cache or 0
             if page_id in self._cache:
                 return {
@@ -147,57 +337,62 @@ class VisitCounterService:
         """Get visit count for a page"""
         try:
             # Check cache first
-            if page_id in self._cache:
-                cache_entry = self._cache[page_id]
-                current_time = time.time()
-                
-                # If cache is still valid
-                if current_time - cache_entry["timestamp"] < self.cache_ttl:
-                    return {
-                        "visits": cache_entry["count"],
-                        "served_via": "in_memory"
-                    }
+            cache_entry = self._cache.get(page_id)
+            if cache_entry and cache_entry["expires_at"] > time.monotonic():
+                self._cache.move_to_end(page_id)
+                return {
+                    "visits": cache_entry["count"],
+                    "served_via": "in_memory"
+                }
             
-            # Cache miss or expired, get from Redis
-            redis_client, node = self._get_redis_client(page_id)
+            # Only one coroutine per page goes to Redis; the rest wait and reuse its result
+            lock = self._locks.get(page_id)
+            if lock is None:
+                lock = asyncio.Lock()
+                self._locks[page_id] = lock
             
-            # Check if we need to flush on this read
-            current_time = time.time()
-            if current_time - self.last_flush_time >= self.flush_interval:
-                await self._flush_buffer()
-                self.last_flush_time = current_time
-                
-            # Get from Redis
-            try:
-                redis_count = int(redis_client.get(f"page:{page_id}") or 0)
-            except Exception as e:
-                logging.error(f"Redis error: {str(e)}")
-                # If cache exists but expired, still use it as fallback
-                if page_id in self._cache:
+            async with lock:
+                cache_entry = self._cache.get(page_id)
+                if cache_entry and cache_entry["expires_at"] > time.monotonic():
                     return {
-                        "visits": self._cache[page_id]["count"],
+                        "visits": cache_entry["count"],
                         "served_via": "in_memory"
                     }
-                redis_count = 0
-            
-            # Get from buffer
-            buffer_count = self._write_buffer[node].get(page_id, 0)
-            total_count = redis_count + buffer_count
-            
-            # Update cache
-            self._cache[page_id] = {
-                "count": total_count,
-                "timestamp": time.time(),
-                "node": node
-            }
-            
-            return {
-                "visits": total_count,
-                "served_via": node
-            }
+                
+                # Cache miss or expired, get from Redis
+                node = self.consistent_hash.get_node(page_id)
+                
+                # Get from Redis
+                try:
+                    redis_count = int(await self._read_count(page_id, node) or b"0")
+                except Exception as e:
+                    logging.error("Redis error: %s", e)
+                    # If cache exists but expired, still use it as fallback
+                    if page_id in self._cache:
+                        return {
+                            "visits": self._cache[page_id]["count"],
+                            "served_via": "in_memory"
+                        }
+                    redis_count = 0
+                
+                # Get from buffer
+                buffer_count = self._buffered_count(node, page_id)
+                total_count = redis_count + buffer_count
+                
+                # Update cache
+                self._set_cache(page_id, {
+                    "count": total_count,
+                    "expires_at": time.monotonic() + self.cache_ttl,
+                    "node": node
+                })
+                
+                return {
+                    "visits": total_count,
+                    "served_via": node
+                }
             
         except Exception as e:
-            logging.error(f"Error in get_visit_count: {str(e)}")
+            logging.error("Error in get_visit_count: %s", e)
             # Fallback to cache or 0
             if page_id in self._cache:
                 return {
@@ -206,35 +401,130 @@ class VisitCounterService:
                 }
             return {"visits": 0, "served_via": "in_memory"}
 
-    async def _flush_buffer(self) -> None:
-        """Flush write buffer to Redis"""
-        for node, buffer in self._write_buffer.items():
-            if not buffer:  # Skip empty buffers
+    def _ensure_flush_loop(self) -> None:
+        """Start the flush loop if it is not running"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def _has_backlog(self, node: Optional[str] = None) -> bool:
+        """True while any hits (for one node, if given) are waiting to reach Redis"""
+        if node is not None:
+            return bool(self._write_buffer[node] or self._flushing[node])
+        return any(self._write_buffer.values()) or any(self._flushing.values())
+
+    def _schedule_flush(self) -> None:
+        """Wake the flush loop, starting it on first use"""
+        self._ensure_flush_loop()
+        self._flush_event.set()
+        if sum(len(buffer) for buffer in self._write_buffer.values()) >= self.max_buffer_entries:
+            self._buffer_full.set()
+
+    async def _flush_loop(self) -> None:
+        """Flush buffered hits in micro-batches"""
+        while True:
+            await self._flush_event.wait()
+            self._flush_event.clear()
+            
+            # Give concurrent hits a short window to join the batch
+            if not self._buffer_full.is_set():
+                try:
+                    await asyncio.wait_for(self._buffer_full.wait(), timeout=self.max_flush_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._buffer_full.clear()
+            
+            await self._flush_buffer()
+            
+            # Redis is unavailable: keep retrying until the backlog drains
+            delay = self.max_flush_delay
+            while self._has_backlog():
+                self._redis_recovered.clear()
+                try:
+                    await asyncio.wait_for(self._redis_recovered.wait(), timeout=delay)
+                    # Woken early: only retry the nodes that just answered
+                    nodes, self._recovered_nodes = self._recovered_nodes, set()
+                except asyncio.TimeoutError:
+                    delay = min(delay * 2, self.max_retry_delay)
+                    nodes = None
+                await self._flush_buffer(nodes)
+
+    def _next_hit_id(self) -> bytes:
+        """Return an id unique to this process and hit"""
+        self._hit_seq += 1
+        return b"%d" % self._hit_seq
+
+    def _take_confirmed(self, node: str) -> List[bytes]:
+        """Pop confirmed hit ids whose markers can be deleted"""
+        confirmed = self._confirmed_hits[node]
+        forget = confirmed[-self.max_forget_batch:]
+        del confirmed[-self.max_forget_batch:]
+        return forget
+
+    def _buffered_count(self, node: str, page_id: str) -> int:
+        """Hits for a page not yet confirmed in Redis"""
+        return (len(self._write_buffer[node].get(page_id, ()))
+                + len(self._flushing[node].get(page_id, ())))
+
+    async def _flush_buffer(self, nodes: Optional[set] = None) -> None:
+        """Flush write buffer to Redis, for the given nodes or all of them"""
+        # Bind hot methods once per flush rather than per buffered page
+        key = self._key
+        set_cache = self._set_cache
+        marker_key = self._marker_key
+        for node in list(self._write_buffer if nodes is None else nodes):
+            batch = self._write_buffer[node]
+            if not batch:  # Skip empty buffers
                 continue
-                
+            
+            # Swap in a fresh buffer; hits arriving during the flush go there
+            self._write_buffer[node] = defaultdict(list)
+            self._flushing[node] = batch
+            forget = self._take_confirmed(node)
+            cmds = list(batch.items())
             try:
-                # Copy buffer and clear it
-                buffer_to_flush = buffer.copy()
-                buffer.clear()
-                
-                # Use pipeline for efficiency
-                redis_client = self.redis_nodes[node]
-                pipeline = redis_client.pipeline()
-                for page_id, count in buffer_to_flush.items():
-                    pipeline.incrby(f"page:{page_id}", count)
-                pipeline.execute()
-                
-                # Update cache with new values
-                for page_id in buffer_to_flush:
-                    if page_id in self._cache:
-                        redis_count = int(redis_client.get(f"page:{page_id}") or 0)
-                        self._cache[page_id]["count"] = redis_count
-                        self._cache[page_id]["timestamp"] = time.time()
-                
+                # Use pipeline for efficiency; registering the script once lets
+                # it be loaded on NOSCRIPT before the batch runs
+                incr_script = self._incr_scripts[node]
+                pipeline = self.redis_nodes[node].pipeline(transaction=False)
+                pipeline.scripts.add(incr_script)
+                evalsha = pipeline.evalsha
+                sha = incr_script.sha
+                for page_id, hit_ids in cmds:
+                    hash_key, field = key(page_id)
+                    evalsha(sha, 2, hash_key, marker_key, field, _HIT_MARKER_TTL, len(hit_ids), *hit_ids)
+                if forget:
+                    pipeline.hdel(marker_key, *forget)
+                results = await pipeline.execute(raise_on_error=False)
+            except asyncio.CancelledError:
+                # Shutting down mid-flush: keep the hits for the final flush
+                for page_id, hit_ids in cmds:
+                    self._write_buffer[node][page_id].extend(hit_ids)
+                self._confirmed_hits[node].extend(forget)
+                raise
             except Exception as e:
-                logging.error(f"Error flushing buffer for {node}: {str(e)}")
-                # Restore buffer on error
-                for page_id, count in buffer_to_flush.items():
-                    if page_id not in buffer:
-                        buffer[page_id] = 0
-                    buffer[page_id] += count
\ No newline at end of file
+                results = [e] * (len(cmds) + bool(forget))
+            finally:
+                self._flushing[node] = {}
+            
+            confirmed = self._confirmed_hits[node]
+            if forget and isinstance(results[-1], Exception):
+                confirmed.extend(forget)
+            
+            # Script replies are the post-increment counts. Unconfirmed hits go
+            # back to the buffer and are retried under the same ids.
+            buffer = self._write_buffer[node]
+            expires_at = time.monotonic() + self.cache_ttl
+            error = None
+            for (page_id, hit_ids), result in zip(cmds, results):
+                if isinstance(result, Exception):
+                    error = result
+                    buffer[page_id].extend(hit_ids)
+                    continue
+                confirmed.extend(hit_ids)
+                set_cache(page_id, {
+                    "count": result + self._buffered_count(node, page_id),
+                    "expires_at": expires_at,
+                    "node": node
+                })
+            if error is not None:
+                logging.error("Error flushing buffer for %s: %s", node, error)
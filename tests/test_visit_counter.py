@@ -0,0 +1,139 @@
+"""Tests for the buffered, idempotent write path of VisitCounterService"""
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # Lua scripting support for fakeredis
+
+import redis.asyncio as aioredis
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from app.services.visit_counter import VisitCounterService
+
+
+class ReplyLostRedis:
+    """Runs scripts on the server, then fails as if the reply was lost"""
+
+    def __init__(self, client):
+        self._client = client
+
+    async def evalsha(self, *args):
+        await self._client.evalsha(*args)
+        raise RedisTimeoutError("Timeout reading from socket")
+
+    async def script_load(self, script):
+        return await self._client.script_load(script)
+
+
+def make_service():
+    VisitCounterService._instance = None
+    service = VisitCounterService()
+    service.cache_ttl = 0
+    client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    for node in service.redis_nodes:
+        service.redis_nodes[node] = client
+    return service, client
+
+
+async def stored_count(service, client, page_id):
+    hash_key, field = service._key(page_id)
+    return int(await client.hget(hash_key, field) or 0)
+
+
+def test_hit_with_lost_reply_is_not_counted_twice():
+    async def run():
+        service, client = make_service()
+        node = service.consistent_hash.get_node("home")
+        service.redis_nodes[node] = ReplyLostRedis(client)
+
+        result = await service.increment_visit("home")
+        assert result["served_via"] == "in_memory"
+
+        # Redis applied the hit, but it is still buffered for retry
+        service.redis_nodes[node] = client
+        await service._flush_buffer()
+        assert await stored_count(service, client, "home") == 1
+        assert not service._has_backlog()
+
+    asyncio.run(run())
+
+
+def test_flush_retry_skips_hits_already_applied():
+    async def run():
+        service, client = make_service()
+        node_a = service.consistent_hash.get_node("a")
+        node_b = service.consistent_hash.get_node("b")
+
+        # Hit 1 reached Redis before the flush pipeline broke; hit 2 did not
+        hash_key, field = service._key("a")
+        await service._incr_scripts[node_a](
+            keys=[hash_key, service._marker_key],
+            args=[field, 60, 1, b"1"],
+            client=client
+        )
+        service._write_buffer[node_a]["a"].append(b"1")
+        service._write_buffer[node_b]["b"].append(b"2")
+
+        await service._flush_buffer()
+        assert await stored_count(service, client, "a") == 1
+        assert await stored_count(service, client, "b") == 1
+
+        # Retrying the same hits again changes nothing
+        service._write_buffer[node_a]["a"].append(b"1")
+        service._write_buffer[node_b]["b"].append(b"2")
+        await service._flush_buffer()
+        assert await stored_count(service, client, "a") == 1
+        assert await stored_count(service, client, "b") == 1
+
+    asyncio.run(run())
+
+
+def test_hits_buffered_during_outage_reach_redis_after_recovery():
+    async def run():
+        service, client = make_service()
+        node = service.consistent_hash.get_node("home")
+        service.redis_nodes[node] = aioredis.Redis(host="127.0.0.1", port=1)
+
+        counts = [(await service.increment_visit("home"))["visits"] for _ in range(3)]
+        assert counts == [1, 2, 3]
+
+        service.redis_nodes[node] = client
+        assert (await service.increment_visit("home"))["visits"] == 4
+        await asyncio.sleep(0.1)
+
+        assert await stored_count(service, client, "home") == 4
+        assert (await service.get_visit_count("home"))["visits"] == 4
+        assert not service._has_backlog()
+
+    asyncio.run(run())
+
+
+def test_healthy_node_does_not_wake_retries_for_a_dead_node():
+    async def run():
+        service, client = make_service()
+        dead = service.consistent_hash.get_node("home")
+        live_page = next(
+            page for page in map(str, range(1000))
+            if service.consistent_hash.get_node(page) != dead
+        )
+        service.redis_nodes[dead] = aioredis.Redis(host="127.0.0.1", port=1)
+
+        flush_buffer = service._flush_buffer
+        attempts = []
+
+        async def counting_flush(nodes=None):
+            if nodes is None or dead in nodes:
+                attempts.append(nodes)
+            await flush_buffer(nodes)
+
+        service._flush_buffer = counting_flush
+        await service.increment_visit("home")
+        for _ in range(200):
+            await service.increment_visit(live_page)
+
+        # Only the initial flush and a few backoff retries touch the dead node
+        assert len(attempts) < 20
+        assert service._has_backlog(dead)
+
+    asyncio.run(run())